@@ -5,6 +5,8 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_migrate import Migrate
 from dotenv import load_dotenv
+from app.cache import PageCache
+from app.ledger import PurchaseLedger
 import os
 
 # Load environment variables from .env file
@@ -14,6 +16,8 @@ db = SQLAlchemy()
 login = LoginManager()
 limiter = Limiter(key_func=get_remote_address)
 migrate = Migrate()
+page_cache = PageCache()
+purchase_ledger = PurchaseLedger()
 
 def create_app():
     app = Flask(__name__)
@@ -23,6 +27,8 @@ def create_app():
     login.init_app(app)
     limiter.init_app(app)
     migrate.init_app(app, db)
+    page_cache.init_app(app)
+    purchase_ledger.init_app(app)
 
     login.login_view = 'login'
     
@@ -39,7 +45,8 @@ def create_app():
             'Payment': models.Payment,
             'Faculty': models.Faculty,
             'Course': models.Course,
-            'Purchase': models.Purchase
+            'Purchase': models.Purchase,
+            'CatalogAvailability': models.CatalogAvailability
         }
 
     return app
@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from blinker import Namespace
+from flask import request, session
+from flask_login import current_user
+
+# Sent after any commit that changes what the browse pages show
+_signals = Namespace()
+catalog_changed = _signals.signal('catalog-changed')
+
+
+def viewer_role():
+    if not current_user.is_authenticated:
+        return 'anonymous'
+    if current_user.is_admin:
+        return 'admin'
+    return 'student'
+
+
+class PageCache:
+    """Rendered-page cache with an in-process LRU tier and an optional disk tier.
+
+    The disk tier lives in ``PAGE_CACHE_DIR`` and can be shared by several
+    worker processes on one host. A marker file in that directory carries the
+    catalog generation, so an invalidation in one worker is seen by the others.
+
+    Without ``PAGE_CACHE_DIR`` an invalidation only reaches the worker that
+    sent ``catalog_changed``; other workers may serve a page for up to
+    ``PAGE_CACHE_TTL`` seconds after it changed. Multi-worker deployments
+    that need uploads to show up at once should set ``PAGE_CACHE_DIR``.
+
+    Disk-tier errors are logged and treated as misses, so a broken or full
+    ``PAGE_CACHE_DIR`` never turns a rendered page into an error.
+    """
+
+    def __init__(self, app=None):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.max_entries = 0
+        self.max_disk_entries = 0
+        self.ttl = 0
+        self.directory = None
+        self.logger = logging.getLogger(__name__)
+        self._sets_since_trim = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('PAGE_CACHE_MAX_ENTRIES', 512)
+        self.max_disk_entries = app.config.get('PAGE_CACHE_DIR_MAX_ENTRIES', 4096)
+        self.ttl = app.config.get('PAGE_CACHE_TTL', 30)
+        self.directory = app.config.get('PAGE_CACHE_DIR')
+        self.logger = app.logger
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError:
+                self.logger.exception('Page cache directory %s is unusable', self.directory)
+        catalog_changed.connect(self._on_catalog_changed, sender=app, weak=False)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _marker_path(self):
+        return os.path.join(self.directory, 'generation')
+
+    def current_generation(self):
+        if not self.directory:
+            return self._generation
+        try:
+            # The marker is replaced rather than rewritten, so the inode changes on every bump
+            st = os.stat(self._marker_path())
+            return (st.st_ino, st.st_mtime_ns)
+        except FileNotFoundError:
+            return 0
+        except OSError:
+            self.logger.exception('Reading the page cache generation failed')
+            return None
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.html')
+
+    def get(self, key, generation):
+        if generation is None:
+            return None
+        key = (generation,) + key
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, body = entry
+                if expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return body
+                del self._entries[key]
+        if not self.directory:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding='utf-8') as fh:
+                body = fh.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            self.logger.exception('Reading %s from the page cache failed', path)
+            return None
+        self._remember(key, body)
+        return body
+
+    def set(self, key, generation, body):
+        if generation is None:
+            return
+        key = (generation,) + key
+        self._remember(key, body)
+        if not self.directory:
+            return
+        path = self._disk_path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as fh:
+                fh.write(body)
+            os.replace(tmp_path, path)
+        except OSError:
+            self.logger.exception('Writing %s to the page cache failed', path)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        # Listing the directory is O(n), so only trim once every eighth of the cap
+        with self._lock:
+            self._sets_since_trim += 1
+            due = self._sets_since_trim >= max(1, self.max_disk_entries // 8)
+            if due:
+                self._sets_since_trim = 0
+        if due:
+            try:
+                self._trim_disk()
+            except OSError:
+                self.logger.exception('Trimming the page cache failed')
+
+    def _remember(self, key, body):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _disk_files(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.html')]
+
+    def _trim_disk(self):
+        paths = self._disk_files()
+        if len(paths) <= self.max_disk_entries:
+            return
+        def last_used(path):
+            try:
+                return os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                return 0
+        paths.sort(key=last_used)
+        for path in paths[:len(paths) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+        if not self.directory:
+            return
+        try:
+            tmp_path = f'{self._marker_path()}.{os.getpid()}.tmp'
+            open(tmp_path, 'w').close()
+            os.replace(tmp_path, self._marker_path())
+            for path in self._disk_files():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        except OSError:
+            self.logger.exception('Clearing the page cache directory %s failed', self.directory)
+
+    def _on_catalog_changed(self, sender, **extra):
+        self.clear()
+
+    def cached(self, f):
+        """Serve a GET view from the cache, keyed on endpoint, view arguments and viewer role.
+
+        Place it below ``login_required`` so access checks still run on a hit.
+        Requests with pending flash messages bypass the cache, because
+        ``base.html`` renders them into the page.
+        """
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not self.enabled or request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            key = (request.endpoint, tuple(sorted(kwargs.items())), viewer_role())
+            # Read once so a render racing an invalidation is stored under the old generation
+            generation = self.current_generation()
+            body = self.get(key, generation)
+            if body is not None:
+                return body
+            rv = f(*args, **kwargs)
+            if isinstance(rv, str):
+                self.set(key, generation, rv)
+            return rv
+        return decorated_function
@@ -0,0 +1,444 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def _try_lock(fd):
+    """Take an exclusive lock on an open journal without blocking; False if it is held elsewhere."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+class _Entry:
+    def __init__(self, user_id, audio_id, amount):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.audio_id = audio_id
+        self.amount = amount
+        self.date = datetime.utcnow()
+        self.state = 'queued'
+        self.segment = None
+        self.durable = threading.Event()
+        self.error = None
+
+    def to_line(self, **extra):
+        return (json.dumps({
+            'id': self.id,
+            'user_id': self.user_id,
+            'audio_id': self.audio_id,
+            'amount': self.amount,
+            'date': self.date.isoformat(),
+            **extra,
+        }) + '\n').encode('utf-8')
+
+    @classmethod
+    def from_line(cls, line):
+        data = json.loads(line)
+        entry = cls(data['user_id'], data['audio_id'], data['amount'])
+        entry.id = data['id']
+        entry.date = datetime.fromisoformat(data['date'])
+        entry.state = 'taken'
+        entry.durable.set()
+        return entry
+
+
+def read_journal(fd):
+    """Parse a journal from the start, stopping at a torn tail left by a crash mid-write."""
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    entries = []
+    for line in b''.join(chunks).split(b'\n'):
+        if not line:
+            continue
+        try:
+            entries.append(_Entry.from_line(line))
+        except (ValueError, KeyError):
+            break
+    return entries
+
+
+class _Segment:
+    """One locked journal file and how many of its entries are not yet applied."""
+
+    def __init__(self, fd, path):
+        self.fd = fd
+        self.path = path
+        self.unapplied = 0
+
+
+class PurchaseLedger:
+    """Append-only purchase journal with group commit.
+
+    Checkouts are queued to a writer thread. It writes everything that
+    arrives within ``PURCHASE_LEDGER_BATCH_WINDOW`` seconds to the journal
+    with one fsync and wakes the callers. Durable batches go to a separate
+    applier thread, which records them in Payment/Purchase in chunks of at
+    most ``PURCHASE_LEDGER_MAX_APPLY``. A slow or failing database therefore
+    delays only the apply, not the checkout.
+
+    The journal is a series of segments in ``PURCHASE_JOURNAL_DIR``, each
+    locked by the worker writing it. A new segment starts once the current one
+    passes ``PURCHASE_JOURNAL_SEGMENT_BYTES``. A segment is deleted as soon as
+    every entry in it is applied. On startup a worker adopts the segments of
+    dead workers and replays them in the background. Payment and Purchase
+    rows carry the entry id, so a replay never records a checkout twice.
+
+    Until it is applied, each durable checkout also has a marker file under
+    ``pending/<audio_id>/``. Every worker sharing the directory can see it.
+    An entry that can never be applied, such as one for deleted audio, is
+    moved to ``parked.log`` instead of being retried forever.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.directory = None
+        self.batch_window = 0.005
+        self.max_batch = 256
+        self.max_apply = 500
+        self.segment_bytes = 1024 * 1024
+        self._queue = queue.Queue()
+        self._apply_queue = queue.Queue()
+        # Guards entry state, segment counts and _outstanding
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._segment = None
+        self._outstanding = 0
+        self._error = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.directory = app.config.get('PURCHASE_JOURNAL_DIR') or os.path.join(app.instance_path, 'purchase-journal')
+        self.batch_window = app.config.get('PURCHASE_LEDGER_BATCH_WINDOW', 0.005)
+        self.max_batch = app.config.get('PURCHASE_LEDGER_MAX_BATCH', 256)
+        self.max_apply = app.config.get('PURCHASE_LEDGER_MAX_APPLY', 500)
+        self.segment_bytes = app.config.get('PURCHASE_JOURNAL_SEGMENT_BYTES', 1024 * 1024)
+        app.before_request(self.start)
+
+    def start(self):
+        """Open a journal segment and start the writer and applier threads, once per process.
+
+        Segments left by dead workers are adopted and handed to the applier;
+        nothing here touches the database.
+        """
+        if self._segment is not None:
+            return
+        with self._start_lock:
+            if self._segment is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            segment = self._new_segment()
+            recovered = self._adopt_dead_segments(exclude=segment.path)
+            if recovered:
+                self._mark(recovered)
+                with self._lock:
+                    self._outstanding += len(recovered)
+                for i in range(0, len(recovered), self.max_apply):
+                    self._apply_queue.put(recovered[i:i + self.max_apply])
+            threading.Thread(target=self._write_loop, name='purchase-ledger-writer', daemon=True).start()
+            threading.Thread(target=self._apply_loop, name='purchase-ledger-applier', daemon=True).start()
+            self._segment = segment
+
+    def _new_segment(self):
+        # Lock the file before it gets its .journal name, so other workers never see it unlocked
+        path = os.path.join(self.directory, f'{uuid.uuid4().hex}.journal')
+        fd = os.open(path + '.new', os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+        _try_lock(fd)
+        os.replace(path + '.new', path)
+        return _Segment(fd, path)
+
+    def _remove_segment(self, segment):
+        if fcntl is None:
+            # Windows cannot remove an open file
+            os.close(segment.fd)
+            os.remove(segment.path)
+        else:
+            os.remove(segment.path)
+            os.close(segment.fd)
+
+    def _adopt_dead_segments(self, exclude):
+        recovered = []
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.journal') or path == exclude:
+                continue
+            try:
+                fd = os.open(path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                # Skip segments held by a live worker or already adopted and removed
+                if not _try_lock(fd) or os.fstat(fd).st_ino != os.stat(path).st_ino:
+                    os.close(fd)
+                    continue
+            except FileNotFoundError:
+                os.close(fd)
+                continue
+            segment = _Segment(fd, path)
+            entries = read_journal(fd)
+            if not entries:
+                self._remove_segment(segment)
+                continue
+            segment.unapplied = len(entries)
+            for entry in entries:
+                entry.segment = segment
+            recovered.extend(entries)
+        return recovered
+
+    def append(self, user_id, audio_id, amount, timeout=5):
+        """Journal a checkout and return its entry id once the write is durable.
+
+        Raises OSError if the checkout was not recorded. A checkout that times
+        out before the writer takes it is cancelled, so it is never applied.
+        """
+        if self._error is not None:
+            raise self._error
+        self.start()
+        entry = _Entry(user_id, audio_id, amount)
+        with self._lock:
+            self._outstanding += 1
+        self._queue.put(entry)
+        if not entry.durable.wait(timeout):
+            with self._lock:
+                if entry.state == 'queued':
+                    entry.state = 'cancelled'
+                    self._outstanding -= 1
+            if entry.state == 'cancelled':
+                raise OSError('Timed out waiting for the purchase journal')
+            # The writer already has it, so its outcome is the real one
+            entry.durable.wait()
+        if entry.error is not None:
+            raise entry.error
+        return entry.id
+
+    def _marker_dir(self, audio_id):
+        return os.path.join(self.directory, 'pending', str(audio_id))
+
+    def _mark(self, entries):
+        for entry in entries:
+            try:
+                os.makedirs(self._marker_dir(entry.audio_id), exist_ok=True)
+                open(os.path.join(self._marker_dir(entry.audio_id), f'{entry.user_id}-{entry.id}'), 'w').close()
+            except OSError:
+                self.app.logger.exception('Marking purchase %s as pending failed', entry.id)
+
+    def _unmark(self, entries):
+        for entry in entries:
+            try:
+                os.remove(os.path.join(self._marker_dir(entry.audio_id), f'{entry.user_id}-{entry.id}'))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                self.app.logger.exception('Clearing the pending marker of purchase %s failed', entry.id)
+
+    def _markers(self, audio_id):
+        try:
+            return os.listdir(self._marker_dir(audio_id))
+        except FileNotFoundError:
+            return []
+
+    def is_pending(self, user_id, audio_id):
+        """True if any worker holds a durable checkout for this user and audio that is not yet in the database."""
+        prefix = f'{user_id}-'
+        return any(name.startswith(prefix) for name in self._markers(audio_id))
+
+    def has_pending_audio(self, audio_id):
+        """True if any worker holds a durable checkout for this audio that is not yet in the database."""
+        return bool(self._markers(audio_id))
+
+    def wait_until_applied(self, timeout=5):
+        """Block until every checkout this worker has accepted is applied, parked or failed; False on timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if not self._outstanding:
+                    return True
+            time.sleep(0.01)
+        return False
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        with self._lock:
+            batch = [entry for entry in batch if entry.state == 'queued']
+            for entry in batch:
+                entry.state = 'taken'
+        return batch
+
+    def _write(self, batch):
+        with self._lock:
+            segment = self._segment
+            if not segment.unapplied:
+                # Everything in this segment is in the database, so start it over
+                os.ftruncate(segment.fd, 0)
+            elif os.fstat(segment.fd).st_size >= self.segment_bytes:
+                # The full segment still has unapplied entries; _finish removes it once they are applied
+                segment = self._segment = self._new_segment()
+        offset = os.fstat(segment.fd).st_size
+        try:
+            _write_all(segment.fd, b''.join(entry.to_line() for entry in batch))
+            os.fsync(segment.fd)
+        except OSError:
+            # Drop the torn or unsynced tail so later batches stay replayable
+            # and checkouts reported as failed are never applied
+            try:
+                os.ftruncate(segment.fd, offset)
+            except OSError as e:
+                self._error = e
+            raise
+        with self._lock:
+            segment.unapplied += len(batch)
+            for entry in batch:
+                entry.segment = segment
+
+    def _write_loop(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                if self._error is not None:
+                    raise self._error
+                self._write(batch)
+            except OSError as e:
+                with self._lock:
+                    self._outstanding -= len(batch)
+                for entry in batch:
+                    entry.error = e
+                    entry.durable.set()
+                continue
+            self._mark(batch)
+            for entry in batch:
+                entry.durable.set()
+            self._apply_queue.put(batch)
+
+    def _apply_loop(self):
+        backlog = deque()
+        while True:
+            if not backlog:
+                backlog.extend(self._apply_queue.get())
+            # Fold in whatever else became durable meanwhile, up to max_apply per transaction
+            while len(backlog) < self.max_apply:
+                try:
+                    backlog.extend(self._apply_queue.get_nowait())
+                except queue.Empty:
+                    break
+            chunk = [backlog.popleft() for _ in range(min(len(backlog), self.max_apply))]
+            delay = 0.05
+            while True:
+                try:
+                    rejected = self._apply_chunk(chunk)
+                    if rejected:
+                        self._park(rejected)
+                    break
+                except Exception:
+                    self.app.logger.exception('Applying %d journaled purchases failed, retrying in %.2fs', len(chunk), delay)
+                    time.sleep(delay)
+                    delay = min(delay * 2, 5)
+            self._finish(chunk)
+
+    def _apply_chunk(self, entries):
+        """Apply entries, narrowing an IntegrityError down to the entries that cause it."""
+        try:
+            return self._apply(entries)
+        except IntegrityError:
+            if len(entries) == 1:
+                return entries
+            rejected = []
+            for entry in entries:
+                rejected.extend(self._apply_chunk([entry]))
+            return rejected
+
+    def _park(self, entries):
+        path = os.path.join(self.directory, 'parked.log')
+        self.app.logger.error('Parking %d purchases that cannot be applied in %s', len(entries), path)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            _write_all(fd, b''.join(entry.to_line(parked=datetime.utcnow().isoformat()) for entry in entries))
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _finish(self, entries):
+        self._unmark(entries)
+        with self._lock:
+            self._outstanding -= len(entries)
+            drained = set()
+            for entry in entries:
+                entry.segment.unapplied -= 1
+                if not entry.segment.unapplied and entry.segment is not self._segment:
+                    drained.add(entry.segment)
+            for segment in drained:
+                self._remove_segment(segment)
+
+    def _apply(self, entries):
+        """Record entries in Payment/Purchase; returns those whose audio no longer exists."""
+        from app import db
+        from app.models import Audio, Payment, Purchase
+
+        with self.app.app_context():
+            try:
+                applied = {
+                    row.ledger_entry for row in Purchase.query.with_entities(Purchase.ledger_entry).filter(
+                        Purchase.ledger_entry.in_([entry.id for entry in entries])
+                    )
+                }
+                audio_ids = {
+                    row.id for row in Audio.query.with_entities(Audio.id).filter(
+                        Audio.id.in_({entry.audio_id for entry in entries})
+                    )
+                }
+                rejected = []
+                for entry in entries:
+                    if entry.id in applied:
+                        continue
+                    if entry.audio_id not in audio_ids:
+                        rejected.append(entry)
+                        continue
+                    applied.add(entry.id)
+                    db.session.add(Payment(user_id=entry.user_id, amount=entry.amount, date=entry.date, ledger_entry=entry.id))
+                    db.session.add(Purchase(user_id=entry.user_id, audio_id=entry.audio_id, amount=entry.amount, date=entry.date, ledger_entry=entry.id))
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return rejected
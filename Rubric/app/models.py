@@ -2,6 +2,7 @@ from datetime import datetime
 from app import db, login
 from flask_login import UserMixin
 from flask_bcrypt import Bcrypt
+from sqlalchemy.exc import IntegrityError
 
 bcrypt = Bcrypt()
 
@@ -34,6 +35,8 @@ class Audio(db.Model):
     price = db.Column(db.Float, nullable=False)
     filename = db.Column(db.String(100), nullable=False)
     date_uploaded = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    level = db.Column(db.Integer, nullable=False, default=100, index=True)
+    duration = db.Column(db.Float, nullable=False, default=0)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
     purchases = db.relationship('Purchase', backref='audio_file', lazy=True, overlaps="audio_file,audio_purchases")
 
@@ -45,6 +48,7 @@ class Payment(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     date = db.Column(db.DateTime, default=datetime.utcnow)
+    ledger_entry = db.Column(db.String(32), unique=True, nullable=True)
 
 class Purchase(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -52,6 +56,7 @@ class Purchase(db.Model):
     date = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     audio_id = db.Column(db.Integer, db.ForeignKey('audio.id'), nullable=False)
+    ledger_entry = db.Column(db.String(32), unique=True, nullable=True)
     user = db.relationship('User', backref='user_purchases', overlaps="buyer,purchases")
     audio = db.relationship('Audio', backref='audio_purchases', overlaps="audio_file,purchases")
 
@@ -70,3 +75,45 @@ class Course(db.Model):
     course_name = db.Column(db.String(100), nullable=False)
     faculty_id = db.Column(db.Integer, db.ForeignKey('faculty.id'), nullable=False)
     audios = db.relationship('Audio', backref='course', lazy=True)
+
+
+class CatalogAvailability(db.Model):
+    """Audio count and total duration per (level, faculty, course).
+
+    Kept in step with the audio table on upload and delete so the browse
+    pages read one indexed range instead of scanning audio.
+    """
+    __tablename__ = 'catalog_availability'
+    level = db.Column(db.Integer, primary_key=True)
+    faculty_id = db.Column(db.Integer, db.ForeignKey('faculty.id'), primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), primary_key=True)
+    audio_count = db.Column(db.Integer, nullable=False, default=0)
+    total_duration = db.Column(db.Float, nullable=False, default=0)
+
+    @classmethod
+    def record(cls, audio, sign=1):
+        """Add (sign=1) or remove (sign=-1) an audio's contribution; caller commits.
+
+        Counters are changed in SQL so concurrent uploads cannot lose an update.
+        """
+        course = db.session.get(Course, audio.course_id)
+        rows = cls.query.filter_by(level=audio.level, faculty_id=course.faculty_id, course_id=course.id)
+        changes = {
+            cls.audio_count: cls.audio_count + sign,
+            cls.total_duration: cls.total_duration + sign * (audio.duration or 0),
+        }
+        updated = rows.update(changes, synchronize_session=False)
+        if sign < 0:
+            rows.filter(cls.audio_count <= 0).delete(synchronize_session=False)
+            return
+        if updated:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(
+                    level=audio.level, faculty_id=course.faculty_id, course_id=course.id,
+                    audio_count=1, total_duration=audio.duration or 0
+                ))
+        except IntegrityError:
+            # Another upload created the row first
+            rows.update(changes, synchronize_session=False)
@@ -1,11 +1,14 @@
 from datetime import datetime
 from functools import wraps
 from flask import render_template, redirect, url_for, flash, request, current_app as app, send_from_directory, abort
-from app import db, login
+from app import db, login, page_cache, purchase_ledger
+from app.cache import catalog_changed
 from flask_login import current_user, login_user, logout_user, login_required
-from app.models import User, Audio, Payment, Faculty, Course, Purchase
+from app.models import User, Audio, Payment, Faculty, Course, Purchase, CatalogAvailability
 from app.forms import LoginForm, RegistrationForm, ProfileForm
 from werkzeug.utils import secure_filename
+from sqlalchemy import func
+import math
 import os
 
 # Bcrypt initialization
@@ -24,8 +27,9 @@ def admin_required(f):
 # Home page route
 @app.route('/')
 @app.route('/index')
+@page_cache.cached
 def index():
-    levels = [100, 200, 300, 400]
+    levels = [row.level for row in db.session.query(CatalogAvailability.level).distinct().order_by(CatalogAvailability.level)]
     return render_template('index.html', title='Home', levels=levels)
 
 # Login route
@@ -91,18 +95,31 @@ def profile():
 # Levels route
 @app.route('/levels/<int:level>')
 @login_required
+@page_cache.cached
 def levels(level):
-    faculties = Faculty.query.filter(
-        Faculty.courses.any(Course.audios.any(Audio.level == level))
-    ).all()
+    faculties = db.session.query(
+        Faculty,
+        func.sum(CatalogAvailability.audio_count),
+        func.sum(CatalogAvailability.total_duration)
+    ).join(CatalogAvailability, CatalogAvailability.faculty_id == Faculty.id).filter(
+        CatalogAvailability.level == level
+    ).group_by(Faculty.id).order_by(Faculty.name).all()
     return render_template('levels.html', title=f'{level} Level', level=level, faculties=faculties)
 
 # Faculty route
 @app.route('/levels/<int:level>/faculty/<int:faculty_id>')
 @login_required
+@page_cache.cached
 def faculty(level, faculty_id):
-    faculty = Faculty.query.get_or_404(faculty_id)
-    courses = Course.query.filter_by(faculty_id=faculty_id).all()
+    courses = db.session.query(CatalogAvailability, Course, Faculty).join(
+        Course, Course.id == CatalogAvailability.course_id
+    ).join(Faculty, Faculty.id == CatalogAvailability.faculty_id).filter(
+        CatalogAvailability.level == level,
+        CatalogAvailability.faculty_id == faculty_id
+    ).order_by(Course.course_name).all()
+    if not courses:
+        abort(404)
+    faculty = courses[0].Faculty
     return render_template('faculty.html', title=f'{faculty.name} Faculty', level=level, faculty=faculty, courses=courses)
 
 # Courses route
@@ -110,7 +127,7 @@ def faculty(level, faculty_id):
 @login_required
 def courses(level, faculty_id, course_id):
     course = Course.query.get_or_404(course_id)
-    audios = Audio.query.filter_by(course_id=course.id).all()
+    audios = Audio.query.filter_by(course_id=course.id, level=level).all()
     return render_template('courses.html', title=course.course_name, level=level, faculty_id=faculty_id, course=course, audios=audios)
 
 # Admin route
@@ -133,32 +150,68 @@ def upload_audio():
     file = request.files.get('file')
     if not file or not allowed_file(file.filename):
         flash("Invalid file format.", "danger")
-        return redirect(request.referrer)
+        return redirect(request.referrer or url_for('admin'))
+    try:
+        price = float(form['price'])
+        course_id = int(form['course_id'])
+        level = int(form.get('level', 100))
+        duration = float(form.get('duration') or 0)
+    except (KeyError, ValueError):
+        flash("Price, course, level and duration must be numbers.", "danger")
+        return redirect(request.referrer or url_for('admin'))
+    if not (math.isfinite(price) and math.isfinite(duration)) or price < 0 or duration < 0 or level <= 0:
+        flash("Level must be positive and price and duration cannot be negative.", "danger")
+        return redirect(request.referrer or url_for('admin'))
+    if db.session.get(Course, course_id) is None:
+        flash("Unknown course.", "danger")
+        return redirect(request.referrer or url_for('admin'))
     filename = secure_filename(file.filename)
     file.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
     audio = Audio(
         title=form['title'],
-        price=form['price'],
-        course_id=form['course_id'],
+        price=price,
+        course_id=course_id,
+        level=level,
+        duration=duration,
         filename=filename
     )
     db.session.add(audio)
+    CatalogAvailability.record(audio)
     db.session.commit()
+    catalog_changed.send(app._get_current_object())
     flash("Audio uploaded successfully!", "success")
     return redirect(url_for('admin'))
 
+# Delete audio route
+@app.route('/admin/delete_audio/<int:audio_id>', methods=['POST'])
+@login_required
+@admin_required
+def delete_audio(audio_id):
+    audio = Audio.query.get_or_404(audio_id)
+    if Purchase.query.filter_by(audio_id=audio.id).first() or purchase_ledger.has_pending_audio(audio.id):
+        flash("Audio has been purchased and cannot be deleted.", "danger")
+        return redirect(url_for('admin'))
+    CatalogAvailability.record(audio, sign=-1)
+    db.session.delete(audio)
+    db.session.commit()
+    catalog_changed.send(app._get_current_object())
+    file_path = os.path.join(app.config['UPLOAD_FOLDER'], audio.filename)
+    if os.path.exists(file_path) and not Audio.query.filter_by(filename=audio.filename).first():
+        os.remove(file_path)
+    flash("Audio deleted.", "success")
+    return redirect(url_for('admin'))
+
 # Purchase route
 @app.route('/purchase/<int:audio_id>', methods=['GET', 'POST'])
 @login_required
 def purchase_audio(audio_id):
     audio = Audio.query.get_or_404(audio_id)
     if request.method == 'POST':
-        payment = Payment(user_id=current_user.id, amount=audio.price)
-        db.session.add(payment)
-        db.session.commit()
-        purchase = Purchase(user_id=current_user.id, audio_id=audio.id, amount=audio.price)
-        db.session.add(purchase)
-        db.session.commit()
+        try:
+            purchase_ledger.append(current_user.id, audio.id, audio.price)
+        except OSError:
+            flash('Purchase could not be recorded, please try again.', 'danger')
+            return redirect(url_for('purchase_audio', audio_id=audio.id))
         flash('Purchase successful!', 'success')
         return redirect(url_for('download_audio', audio_id=audio.id))
     return render_template('purchase_audio.html', audio=audio)
@@ -168,7 +221,7 @@ def purchase_audio(audio_id):
 @login_required
 def download_audio(audio_id):
     purchase = Purchase.query.filter_by(user_id=current_user.id, audio_id=audio_id).first()
-    if not purchase:
+    if not purchase and not purchase_ledger.is_pending(current_user.id, audio_id):
         flash("You need to purchase this audio before downloading.", "danger")
         return redirect(url_for('index'))
     audio = Audio.query.get_or_404(audio_id)
@@ -7,4 +7,15 @@ class Config:
     RATELIMIT_DEFAULT = '200 per day;50 per hour'
     RATELIMIT_STORAGE_URL = 'memory://'
     UPLOAD_FOLDER = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'app/static/uploads')
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
\ No newline at end of file
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+    PAGE_CACHE_MAX_ENTRIES = int(os.getenv('PAGE_CACHE_MAX_ENTRIES', 512))
+    PAGE_CACHE_TTL = int(os.getenv('PAGE_CACHE_TTL', 30))
+    # Shared tier for multi-worker deployments; without it other workers see uploads after PAGE_CACHE_TTL
+    PAGE_CACHE_DIR = os.getenv('PAGE_CACHE_DIR')
+    PAGE_CACHE_DIR_MAX_ENTRIES = int(os.getenv('PAGE_CACHE_DIR_MAX_ENTRIES', 4096))
+    # Shared by every worker on the host: locked journal segments and pending-purchase markers.
+    # Defaults to instance/purchase-journal
+    PURCHASE_JOURNAL_DIR = os.getenv('PURCHASE_JOURNAL_DIR')
+    PURCHASE_JOURNAL_SEGMENT_BYTES = int(os.getenv('PURCHASE_JOURNAL_SEGMENT_BYTES', 1024 * 1024))
+    PURCHASE_LEDGER_BATCH_WINDOW = float(os.getenv('PURCHASE_LEDGER_BATCH_WINDOW', 0.005))
+    PURCHASE_LEDGER_MAX_APPLY = int(os.getenv('PURCHASE_LEDGER_MAX_APPLY', 500))
\ No newline at end of file
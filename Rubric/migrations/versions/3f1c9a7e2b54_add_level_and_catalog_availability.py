@@ -0,0 +1,50 @@
+"""Add level and duration to Audio, add catalog_availability
+
+Revision ID: 3f1c9a7e2b54
+Revises: d26c4d1e26f8
+Create Date: 2026-10-19 10:12:40.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7e2b54'
+down_revision = 'd26c4d1e26f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('audio', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('level', sa.Integer(), nullable=False, server_default='100'))
+        batch_op.add_column(sa.Column('duration', sa.Float(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_audio_level', ['level'], unique=False)
+
+    op.create_table('catalog_availability',
+    sa.Column('level', sa.Integer(), nullable=False),
+    sa.Column('faculty_id', sa.Integer(), nullable=False),
+    sa.Column('course_id', sa.Integer(), nullable=False),
+    sa.Column('audio_count', sa.Integer(), nullable=False),
+    sa.Column('total_duration', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['course_id'], ['course.id'], ),
+    sa.ForeignKeyConstraint(['faculty_id'], ['faculty.id'], ),
+    sa.PrimaryKeyConstraint('level', 'faculty_id', 'course_id')
+    )
+
+    # Backfill from the audio already in the catalog
+    op.execute(
+        "INSERT INTO catalog_availability (level, faculty_id, course_id, audio_count, total_duration) "
+        "SELECT audio.level, course.faculty_id, course.id, COUNT(audio.id), SUM(audio.duration) "
+        "FROM audio JOIN course ON course.id = audio.course_id "
+        "GROUP BY audio.level, course.faculty_id, course.id"
+    )
+
+
+def downgrade():
+    op.drop_table('catalog_availability')
+    with op.batch_alter_table('audio', schema=None) as batch_op:
+        batch_op.drop_index('ix_audio_level')
+        batch_op.drop_column('duration')
+        batch_op.drop_column('level')
@@ -0,0 +1,36 @@
+"""Add ledger_entry to Payment and Purchase
+
+Revision ID: 7d2e4b81c0a3
+Revises: 3f1c9a7e2b54
+Create Date: 2026-10-19 14:37:05.902611
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2e4b81c0a3'
+down_revision = '3f1c9a7e2b54'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ledger_entry', sa.String(length=32), nullable=True))
+        batch_op.create_unique_constraint('uq_payment_ledger_entry', ['ledger_entry'])
+
+    with op.batch_alter_table('purchase', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('ledger_entry', sa.String(length=32), nullable=True))
+        batch_op.create_unique_constraint('uq_purchase_ledger_entry', ['ledger_entry'])
+
+
+def downgrade():
+    with op.batch_alter_table('purchase', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_purchase_ledger_entry', type_='unique')
+        batch_op.drop_column('ledger_entry')
+
+    with op.batch_alter_table('payment', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_payment_ledger_entry', type_='unique')
+        batch_op.drop_column('ledger_entry')
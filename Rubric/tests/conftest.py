@@ -0,0 +1,61 @@
+import os
+import tempfile
+import pytest
+
+# Config reads these at import time, so they must be set before the app is imported
+_tmp = tempfile.mkdtemp()
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_tmp, 'test.db')
+os.environ['PURCHASE_JOURNAL_DIR'] = os.path.join(_tmp, 'purchase-journal')
+
+from app import create_app, db, limiter, page_cache
+
+
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['UPLOAD_FOLDER'] = os.path.join(_tmp, 'uploads')
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    limiter.enabled = False
+    return app
+
+
+@pytest.fixture(autouse=True)
+def clean_state(app):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    page_cache.clear()
+    yield
+    with app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def catalog(app):
+    """One faculty with two courses, an admin and a student; returns their ids."""
+    from app.models import Course, Faculty, User
+    with app.app_context():
+        faculty = Faculty(name='Faculty of Arts', department='Faculty of Arts')
+        db.session.add(faculty)
+        db.session.flush()
+        history = Course(course_name='History', faculty_id=faculty.id)
+        french = Course(course_name='French', faculty_id=faculty.id)
+        admin = User(username='admin', email='admin@example.com', is_admin=True)
+        student = User(username='student', email='student@example.com', is_admin=False)
+        admin.set_password('secret')
+        student.set_password('secret')
+        db.session.add_all([history, french, admin, student])
+        db.session.commit()
+        return {
+            'faculty': faculty.id, 'history': history.id, 'french': french.id,
+            'admin': admin.id, 'student': student.id,
+        }
+
+
+@pytest.fixture
+def login():
+    def login(client, email):
+        return client.post('/login', data={'email': email, 'password': 'secret'})
+    return login
@@ -0,0 +1,99 @@
+import os
+from types import SimpleNamespace
+import pytest
+from app.cache import PageCache, catalog_changed
+
+
+@pytest.fixture
+def make_cache(app):
+    """Build caches through init_app on a copy of the app config.
+
+    Each cache gets its own sender, so ``catalog_changed`` from the app or
+    from other tests never reaches it; receivers are disconnected afterwards.
+    """
+    made = []
+
+    def make_cache(**overrides):
+        owner = SimpleNamespace(config={**app.config, 'PAGE_CACHE_DIR': None, **overrides}, logger=app.logger)
+        cache = PageCache()
+        cache.init_app(owner)
+        cache.owner = owner
+        made.append(cache)
+        return cache
+
+    yield make_cache
+    for cache in made:
+        catalog_changed.disconnect(cache._on_catalog_changed, sender=cache.owner)
+
+
+def test_render_racing_invalidation_is_not_served(app, make_cache):
+    cache = make_cache()
+    calls = []
+
+    @cache.cached
+    def view():
+        calls.append(1)
+        if len(calls) == 1:
+            catalog_changed.send(cache.owner)
+        return f'page {len(calls)}'
+
+    with app.test_request_context('/index'):
+        assert view() == 'page 1'
+        assert view() == 'page 2'
+        assert view() == 'page 2'
+
+
+def test_query_string_does_not_create_entries(app, make_cache):
+    cache = make_cache()
+
+    @cache.cached
+    def view():
+        return 'page'
+
+    for i in range(5):
+        with app.test_request_context(f'/index?x={i}'):
+            view()
+    assert len(cache._entries) == 1
+
+
+def test_expired_entries_are_rendered_again(app, make_cache):
+    cache = make_cache(PAGE_CACHE_TTL=-1)
+    calls = []
+
+    @cache.cached
+    def view():
+        calls.append(1)
+        return 'page'
+
+    with app.test_request_context('/index'):
+        view()
+        view()
+    assert len(calls) == 2
+
+
+def test_disk_tier_is_bounded_and_shared(make_cache, tmp_path):
+    cache = make_cache(PAGE_CACHE_DIR=str(tmp_path), PAGE_CACHE_DIR_MAX_ENTRIES=2)
+    for i in range(3):
+        cache.set(('index', (('n', i),), 'anonymous'), cache.current_generation(), f'page {i}')
+    assert len([name for name in os.listdir(tmp_path) if name.endswith('.html')]) == 2
+
+    other = make_cache(PAGE_CACHE_DIR=str(tmp_path))
+    assert other.get(('index', (('n', 2),), 'anonymous'), other.current_generation()) == 'page 2'
+
+    cache.clear()
+    assert other.get(('index', (('n', 2),), 'anonymous'), other.current_generation()) is None
+
+
+def test_disk_errors_fail_open(app, make_cache, tmp_path):
+    blocker = tmp_path / 'not-a-directory'
+    blocker.write_text('')
+    cache = make_cache(PAGE_CACHE_DIR=str(blocker / 'cache'))
+
+    @cache.cached
+    def view():
+        return 'page'
+
+    with app.test_request_context('/index'):
+        assert view() == 'page'
+        assert view() == 'page'
+    cache.clear()
@@ -0,0 +1,73 @@
+import io
+from app import db
+from app.models import Audio, CatalogAvailability
+
+
+def upload(client, course_id, level, duration='60', title='Lecture', price='5'):
+    return client.post('/admin/upload_audio', data={
+        'title': title, 'price': price, 'course_id': str(course_id),
+        'level': str(level), 'duration': duration,
+        'file': (io.BytesIO(b'audio'), f'{title}.png'),
+    }, content_type='multipart/form-data')
+
+
+def availability(app):
+    with app.app_context():
+        return {
+            (row.level, row.course_id): (row.audio_count, row.total_duration)
+            for row in CatalogAvailability.query.all()
+        }
+
+
+def test_upload_and_delete_maintain_availability(app, catalog, login):
+    client = app.test_client()
+    login(client, 'admin@example.com')
+    upload(client, catalog['history'], 100, title='One')
+    upload(client, catalog['history'], 100, duration='30', title='Two')
+    upload(client, catalog['french'], 200, title='Three')
+    assert availability(app) == {
+        (100, catalog['history']): (2, 90.0),
+        (200, catalog['french']): (1, 60.0),
+    }
+
+    with app.app_context():
+        audio_id = Audio.query.filter_by(title='Three').one().id
+    client.post(f'/admin/delete_audio/{audio_id}')
+    assert availability(app) == {(100, catalog['history']): (2, 90.0)}
+
+
+def test_browse_views_only_list_content(app, catalog, login):
+    client = app.test_client()
+    login(client, 'admin@example.com')
+    upload(client, catalog['history'], 100, title='Intro')
+    upload(client, catalog['history'], 200, title='Advanced')
+
+    index = client.get('/').get_data(as_text=True)
+    assert '100 Level' in index and '200 Level' in index and '300 Level' not in index
+
+    level_page = client.get('/levels/100').get_data(as_text=True)
+    assert 'Faculty of Arts' in level_page
+
+    faculty_page = client.get(f"/levels/100/faculty/{catalog['faculty']}").get_data(as_text=True)
+    assert 'History' in faculty_page and 'French' not in faculty_page
+    assert client.get('/levels/300/faculty/%d' % catalog['faculty']).status_code == 404
+
+    course_page = client.get(
+        f"/levels/100/faculty/{catalog['faculty']}/courses/{catalog['history']}"
+    ).get_data(as_text=True)
+    assert 'Intro' in course_page and 'Advanced' not in course_page
+
+
+def test_invalid_upload_is_rejected(app, catalog, login):
+    client = app.test_client()
+    login(client, 'admin@example.com')
+    for bad in [
+        {'course_id': 9999, 'level': 100},
+        {'course_id': catalog['history'], 'level': 'abc'},
+        {'course_id': catalog['history'], 'level': 100, 'duration': 'long'},
+    ]:
+        response = upload(client, **bad)
+        assert response.status_code == 302
+    with app.app_context():
+        assert db.session.query(Audio).count() == 0
+    assert availability(app) == {}
@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+import pytest
+from app import db, purchase_ledger
+from app.ledger import PurchaseLedger, _Entry, read_journal
+from app.models import Audio, Payment, Purchase
+
+
+@pytest.fixture
+def audio_id(app, catalog):
+    with app.app_context():
+        audio = Audio(title='Lecture', price=5, filename='lecture.png', course_id=catalog['history'], level=100)
+        db.session.add(audio)
+        db.session.commit()
+        return audio.id
+
+
+@pytest.fixture
+def ledger(app, tmp_path):
+    ledger = PurchaseLedger()
+    ledger.app = app
+    ledger.directory = str(tmp_path)
+    return ledger
+
+
+def purchases(app):
+    with app.app_context():
+        return sorted(row.ledger_entry for row in Purchase.query.all())
+
+
+def test_append_is_applied_once(app, catalog, audio_id, ledger):
+    entry_id = ledger.append(catalog['student'], audio_id, 5.0)
+    assert ledger.wait_until_applied()
+    assert purchases(app) == [entry_id]
+    with app.app_context():
+        assert Payment.query.filter_by(ledger_entry=entry_id).count() == 1
+    assert not ledger.is_pending(catalog['student'], audio_id)
+
+
+def test_concurrent_appends_share_fsyncs(app, catalog, audio_id, ledger, monkeypatch):
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, 'fsync', lambda fd: fsyncs.append(fd) or real_fsync(fd))
+    ledger.start()
+    threads = [threading.Thread(target=ledger.append, args=(catalog['student'], audio_id, 5.0)) for _ in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert ledger.wait_until_applied()
+    assert len(purchases(app)) == 50
+    assert len(fsyncs) < 50
+
+
+def test_replay_recovers_dead_journal_skips_applied_and_torn_tail(app, catalog, audio_id, ledger, tmp_path):
+    entries = [_Entry(catalog['student'], audio_id, 5.0) for _ in range(3)]
+    with app.app_context():
+        db.session.add(Purchase(user_id=catalog['student'], audio_id=audio_id, amount=5.0, ledger_entry=entries[0].id))
+        db.session.add(Payment(user_id=catalog['student'], amount=5.0, ledger_entry=entries[0].id))
+        db.session.commit()
+    dead = tmp_path / 'dead.journal'
+    dead.write_bytes(b''.join(entry.to_line() for entry in entries) + b'{"id": "torn')
+
+    ledger.start()
+    assert ledger.wait_until_applied()
+    assert purchases(app) == sorted(entry.id for entry in entries)
+    assert not dead.exists()
+
+
+def test_live_journal_is_not_claimed(app, catalog, audio_id, ledger, tmp_path):
+    apply_started = threading.Event()
+    ledger._apply = lambda entries: apply_started.set() or time.sleep(60)
+    ledger.append(catalog['student'], audio_id, 5.0)
+    apply_started.wait(5)
+
+    other = PurchaseLedger()
+    other.app = app
+    other.directory = str(tmp_path)
+    other.start()
+    assert other._outstanding == 0
+    assert len(list(tmp_path.glob('*.journal'))) == 2
+    assert len(read_journal(ledger._segment.fd)) == 1
+
+
+def test_timed_out_entry_is_cancelled(app, catalog, audio_id, ledger, monkeypatch):
+    start = ledger.start
+    monkeypatch.setattr(ledger, 'start', lambda: None)
+    with pytest.raises(OSError):
+        ledger.append(catalog['student'], audio_id, 5.0, timeout=0.01)
+    monkeypatch.setattr(ledger, 'start', start)
+
+    entry_id = ledger.append(catalog['student'], audio_id, 5.0)
+    assert ledger.wait_until_applied()
+    assert purchases(app) == [entry_id]
+
+
+def test_failed_write_is_truncated(app, catalog, audio_id, ledger, monkeypatch):
+    ledger.start()
+    ledger._segment.unapplied = 1
+    first, failed, last = (_Entry(catalog['student'], audio_id, 5.0) for _ in range(3))
+    ledger._write([first])
+
+    real_fsync = os.fsync
+    def broken_fsync(fd):
+        raise OSError('disk full')
+    monkeypatch.setattr(os, 'fsync', broken_fsync)
+    with pytest.raises(OSError):
+        ledger._write([failed])
+    monkeypatch.setattr(os, 'fsync', real_fsync)
+
+    ledger._write([last])
+    assert [entry.id for entry in read_journal(ledger._segment.fd)] == [first.id, last.id]
+
+
+def test_failing_apply_does_not_block_checkouts(app, catalog, audio_id, ledger):
+    def broken_apply(entries):
+        raise RuntimeError('database is locked')
+    ledger._apply = broken_apply
+    started = time.monotonic()
+    for _ in range(3):
+        ledger.append(catalog['student'], audio_id, 5.0, timeout=1)
+    assert time.monotonic() - started < 1
+    assert ledger.is_pending(catalog['student'], audio_id)
+    assert purchases(app) == []
+
+
+def test_audio_with_pending_checkout_cannot_be_deleted(app, catalog, audio_id, login):
+    # A checkout journaled by another worker sharing the directory
+    entry = _Entry(catalog['student'], audio_id, 5.0)
+    purchase_ledger.start()
+    purchase_ledger._mark([entry])
+    try:
+        client = app.test_client()
+        login(client, 'admin@example.com')
+        client.post(f'/admin/delete_audio/{audio_id}')
+        with app.app_context():
+            assert db.session.get(Audio, audio_id) is not None
+    finally:
+        purchase_ledger._unmark([entry])
+
+
+def test_pending_checkout_is_visible_to_other_workers(app, catalog, audio_id, ledger, tmp_path):
+    release = threading.Event()
+    apply = ledger._apply
+    ledger._apply = lambda entries: release.wait(5) and apply(entries)
+    ledger.append(catalog['student'], audio_id, 5.0)
+
+    other = PurchaseLedger()
+    other.app = app
+    other.directory = str(tmp_path)
+    assert other.is_pending(catalog['student'], audio_id)
+    assert other.has_pending_audio(audio_id)
+    assert not other.is_pending(catalog['admin'], audio_id)
+
+    release.set()
+    assert ledger.wait_until_applied()
+    assert not other.is_pending(catalog['student'], audio_id)
+    assert not other.has_pending_audio(audio_id)
+
+
+def test_checkout_for_deleted_audio_is_parked(app, catalog, audio_id, ledger, tmp_path):
+    ledger.append(catalog['student'], audio_id + 1000, 5.0)
+    assert ledger.wait_until_applied()
+    assert purchases(app) == []
+    assert not ledger.has_pending_audio(audio_id + 1000)
+    fd = os.open(tmp_path / 'parked.log', os.O_RDONLY)
+    try:
+        assert len(read_journal(fd)) == 1
+    finally:
+        os.close(fd)
+
+    # The worker keeps applying afterwards
+    entry_id = ledger.append(catalog['student'], audio_id, 5.0)
+    assert ledger.wait_until_applied()
+    assert purchases(app) == [entry_id]
+
+
+def test_applied_segments_are_removed(app, catalog, audio_id, ledger, tmp_path):
+    release = threading.Event()
+    apply = ledger._apply
+    ledger._apply = lambda entries: release.wait(5) and apply(entries)
+    ledger.segment_bytes = 1
+    for _ in range(3):
+        ledger.append(catalog['student'], audio_id, 5.0)
+    assert len(list(tmp_path.glob('*.journal'))) == 3
+
+    release.set()
+    assert ledger.wait_until_applied()
+    assert len(purchases(app)) == 3
+    assert list(tmp_path.glob('*.journal')) == [tmp_path / os.path.basename(ledger._segment.path)]
+
+
+def test_replay_is_applied_in_capped_chunks(app, catalog, audio_id, ledger, tmp_path):
+    entries = [_Entry(catalog['student'], audio_id, 5.0) for _ in range(5)]
+    (tmp_path / 'dead.journal').write_bytes(b''.join(entry.to_line() for entry in entries))
+    sizes = []
+    apply = ledger._apply
+    ledger._apply = lambda chunk: sizes.append(len(chunk)) or apply(chunk)
+    ledger.max_apply = 2
+
+    ledger.start()
+    assert ledger.wait_until_applied()
+    assert len(purchases(app)) == 5
+    assert max(sizes) <= 2